@@ -4,19 +4,36 @@ import uuid
 import json
 import psycopg2
 import psycopg2.extras
+from psycopg2 import sql as pg_sql
 import io
-import qrcode
 import logging
 import base64
-from docx import Document
-from docx.shared import Inches
-from flask import send_file, send_from_directory, request, jsonify
+import gzip
+import zlib
+import hashlib
+import hmac
+import threading
+import tempfile
+import time
+import itertools
+import math
+import binascii
+import functools
+from collections import OrderedDict
+from flask import send_file, send_from_directory, request, jsonify, redirect, url_for
 from dotenv import load_dotenv
 from flask import Flask
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime
+from geo import parse_coordinates, parse_map_embed_coordinates, valid_coordinates
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available.
+    brotli = None
 
 # --- App Initialization ---
 load_dotenv()
@@ -26,13 +43,109 @@ logging.basicConfig(level=logging.INFO)
 # Set the maximum content length to 16MB. This is the correct place to handle large request bodies.
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 
 
+# --- Proxy Configuration ---
+# Number of reverse proxies in front of the app whose X-Forwarded-* headers are trusted
+# (1 on Render). With the default of 0 the headers are ignored, since clients can forge them.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS,
+                            x_host=TRUSTED_PROXY_HOPS, x_port=TRUSTED_PROXY_HOPS)
+
 # --- CORS Configuration ---
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:9002')
 CORS(app, resources={r"/*": {"origins": [FRONTEND_URL, "http://localhost:9002"], "supports_credentials": True}})
 
 # --- Database Connection Helper ---
-def get_db_connection():
+# Read-only handlers can be served by replicas listed in DATABASE_REPLICA_URLS (comma-separated).
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# A replica that fails to connect is skipped for this many seconds before being retried.
+REPLICA_RETRY_SECONDS = int(os.getenv('REPLICA_RETRY_SECONDS', 30))
+# After a write, reads go to the primary for this long so the re-render that follows
+# an admin change sees it. Admin writes arrive from Next.js server actions and reads
+# from server-side fetches, neither of which keeps cookies, so the window is tracked
+# on the server: the mtime of a marker file shared by every worker on this host.
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 10))
+RECENT_WRITE_MARKER = os.getenv('RECENT_WRITE_MARKER', os.path.join(tempfile.gettempdir(), 'royal-fernet-last-write'))
+
+class ReplicaPool:
+    """Round-robins over replica URLs, skipping replicas that recently failed."""
+
+    def __init__(self, urls, retry_seconds):
+        self.urls = urls
+        self.retry_seconds = retry_seconds
+        self._order = itertools.cycle(range(len(urls))) if urls else None
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        """Yields healthy replica URLs, starting from the next one in rotation."""
+        if not self.urls:
+            return
+        with self._lock:
+            start = next(self._order)
+        now = time.monotonic()
+        for offset in range(len(self.urls)):
+            url = self.urls[(start + offset) % len(self.urls)]
+            if self._down_until.get(url, 0) <= now:
+                yield url
+
+    def mark_down(self, url):
+        with self._lock:
+            self._down_until[url] = time.monotonic() + self.retry_seconds
+
+replica_pool = ReplicaPool(DATABASE_REPLICA_URLS, REPLICA_RETRY_SECONDS)
+
+def replica_reads(methods=('GET',)):
+    """Declares that a route only reads for the given methods, so it may be served by a replica."""
+    def decorator(view):
+        view.replica_read_methods = frozenset(methods)
+        return view
+    return decorator
+
+def is_replica_read():
+    view = app.view_functions.get(request.endpoint)
+    return request.method in getattr(view, 'replica_read_methods', ())
+
+def record_write():
+    """Starts the read-your-writes window; call it after committing an admin write."""
+    if not replica_pool.urls:
+        return
     try:
+        with open(RECENT_WRITE_MARKER, 'a'):
+            pass
+        os.utime(RECENT_WRITE_MARKER, None)
+    except OSError as e:
+        app.logger.warning(f"Could not record recent write: {e}")
+
+def written_recently():
+    try:
+        return time.time() - os.path.getmtime(RECENT_WRITE_MARKER) < READ_YOUR_WRITES_SECONDS
+    except OSError:
+        return False
+
+def wants_replica():
+    if not replica_pool.urls or not request:
+        return False
+    return is_replica_read() and not written_recently()
+
+def connect_to_replica():
+    for url in replica_pool.candidates():
+        try:
+            connection = psycopg2.connect(url)
+            connection.set_session(readonly=True)
+            return connection
+        except psycopg2.Error as e:
+            app.logger.warning(f"Read replica unavailable, failing over: {e}")
+            replica_pool.mark_down(url)
+    return None
+
+def get_db_connection(primary=False):
+    try:
+        if not primary and wants_replica():
+            connection = connect_to_replica()
+            if connection:
+                return connection
+
         # Render provides the DATABASE_URL env var.
         conn_string = os.getenv('DATABASE_URL')
         if not conn_string:
@@ -52,31 +165,702 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# --- Helper Functions ---
-def file_to_data_uri(file):
-    """Converts a file stream to a Data URI."""
-    if not file or not file.filename:
+# --- Image Uploads ---
+# Multipart parts larger than werkzeug's in-memory threshold are already spooled to
+# temporary files. Uploads are then read in fixed-size chunks to hash and validate
+# them, and COPYed into image_blobs, so an upload is never held in memory whole.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+def sniff_image_type(head):
+    """Returns the image mimetype from a file's leading bytes, ignoring what the client claims."""
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def inspect_upload(stream):
+    """Reads an upload once in chunks; returns (sha256, mimetype, size) or None if it isn't an image."""
+    stream.seek(0)
+    head = stream.read(UPLOAD_CHUNK_SIZE)
+    mimetype = sniff_image_type(head)
+    if not mimetype:
         return None
-    
-    if allowed_file(file.filename):
+    digest = hashlib.sha256(head)
+    size = len(head)
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), mimetype, size
+
+class BlobCopySource:
+    """File-like COPY source that emits one image_blobs row, hex-encoding the upload chunk by chunk."""
+
+    def __init__(self, columns, stream):
+        row_prefix = '\t'.join(columns).encode('utf-8') + b'\t\\\\x'
+        chunks = iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b'')
+        self._parts = itertools.chain([row_prefix], (binascii.hexlify(chunk) for chunk in chunks), [b'\n'])
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            part = next(self._parts, None)
+            if part is None:
+                break
+            self._buffer += part
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def store_uploaded_image(cursor, file):
+    """Validates an uploaded image and stores it in image_blobs. Returns its URL, or None if rejected.
+
+    Blobs are content-addressed by SHA-256, so re-uploading the same image is a no-op.
+    """
+    if not file or not file.filename or not allowed_file(file.filename):
+        return None
+    inspected = inspect_upload(file.stream)
+    if not inspected:
+        app.logger.warning(f"Rejected upload '{file.filename}': not a supported image type.")
+        return None
+    sha256, mimetype, size = inspected
+
+    cursor.execute("SELECT 1 FROM image_blobs WHERE sha256 = %s", (sha256,))
+    if not cursor.fetchone():
+        cursor.execute("SAVEPOINT image_upload")
         try:
-            encoded_string = base64.b64encode(file.read()).decode('utf-8')
-            mime_type = file.mimetype
-            return f"data:{mime_type};base64,{encoded_string}"
-        except Exception as e:
-            app.logger.error(f"Could not convert file to Data URI: {e}")
-            return None
+            cursor.copy_expert("COPY image_blobs (sha256, mimetype, size_bytes, data) FROM STDIN",
+                               BlobCopySource((sha256, mimetype, str(size)), file.stream),
+                               size=2 * UPLOAD_CHUNK_SIZE)
+            cursor.execute("RELEASE SAVEPOINT image_upload")
+        except psycopg2.IntegrityError:
+            # Another request stored the same image concurrently.
+            cursor.execute("ROLLBACK TO SAVEPOINT image_upload")
+    # A relative path: browsers load it through the Next.js /api rewrite, so it
+    # doesn't depend on which host or scheme the backend saw.
+    return url_for('get_image', sha256=sha256)
+
+# --- Response Compression ---
+# Bodies smaller than this are sent as-is; the framing overhead isn't worth it.
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+# Compressed copies of GET responses are kept in each worker's memory, bounded by total bytes.
+app.config['COMPRESS_CACHE_MAX_BYTES'] = int(os.getenv('COMPRESS_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+class CompressedBodyCache:
+    """Thread-safe LRU of compressed bodies keyed by (content version, encoding).
+
+    The content version is a digest of the uncompressed body, so a variant is
+    reused for as long as the underlying data is unchanged and naturally misses
+    as soon as a write changes the payload. The cache is per process: each
+    gunicorn worker compresses each version once for itself.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+compressed_body_cache = CompressedBodyCache(app.config['COMPRESS_CACHE_MAX_BYTES'])
+
+def negotiate_encoding(accept_encodings):
+    """Picks the best supported content-coding from an Accept-Encoding header."""
+    if brotli is not None and accept_encodings['br'] > 0 and accept_encodings['br'] >= accept_encodings['gzip']:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
     return None
 
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+def compress_stream(chunks, encoding):
+    """Compresses a streamed body chunk by chunk, flushing after each one."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        # wbits=31 selects the gzip container.
+        compressor = zlib.compressobj(app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+@app.after_request
+def compress_response(response):
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+        return response
+
+    body = response.get_data()
+    if len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    if request.method == 'GET' and response.status_code == 200:
+        content_version = hashlib.blake2b(body, digest_size=16).hexdigest()
+        cache_key = (content_version, encoding)
+        compressed = compressed_body_cache.get(cache_key)
+        if compressed is None:
+            compressed = compress_body(body, encoding)
+            compressed_body_cache.put(cache_key, compressed)
+        response.set_etag(f"{content_version}-{encoding}")
+    else:
+        compressed = compress_body(body, encoding)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # Answers a matching If-None-Match with 304 Not Modified and no body.
+    return response.make_conditional(request)
+
+# --- Product Lookup Helpers ---
+# Columns for list views that don't need the full description or every image.
+PRODUCT_SUMMARY_COLUMNS = "id, name, category, price, discount, stock, is_featured, images->0 AS image"
+MAX_BATCH_IDS = 500
+
+def normalize_product_id(raw_id):
+    return '' if raw_id is None else str(raw_id).strip()
+
+def parse_product_ids(raw_ids):
+    """Normalizes ids from a comma-separated string or a list, keeping order and dropping duplicates."""
+    if isinstance(raw_ids, str):
+        raw_ids = raw_ids.split(',')
+    ids = []
+    seen = set()
+    for product_id in raw_ids or []:
+        product_id = normalize_product_id(product_id)
+        if product_id and product_id not in seen:
+            seen.add(product_id)
+            ids.append(product_id)
+    return ids
+
+def fetch_products_by_ids(cursor, product_ids, columns="*", for_update=False):
+    """Fetches many products in one round-trip. Returns (rows in request order, missing ids)."""
+    if not product_ids:
+        return [], []
+    sql = f"SELECT {columns} FROM products WHERE id = ANY(%s)"
+    if for_update:
+        # Lock in a stable order so concurrent invoices can't deadlock each other.
+        sql += " ORDER BY id FOR UPDATE"
+    cursor.execute(sql, (list(product_ids),))
+    by_id = {row['id']: row for row in cursor.fetchall()}
+    found = [by_id[product_id] for product_id in product_ids if product_id in by_id]
+    missing = [product_id for product_id in product_ids if product_id not in by_id]
+    return found, missing
+
+def product_batch_response(cursor, raw_ids, fields):
+    product_ids = parse_product_ids(raw_ids)
+    if not product_ids:
+        return jsonify({'error': 'At least one product id is required'}), 400
+    if len(product_ids) > MAX_BATCH_IDS:
+        return jsonify({'error': f'A maximum of {MAX_BATCH_IDS} ids can be requested at once'}), 400
+    columns = PRODUCT_SUMMARY_COLUMNS if fields == 'summary' else "*"
+    products, missing = fetch_products_by_ids(cursor, product_ids, columns)
+    return jsonify({'products': [dict(row) for row in products], 'missing': missing})
+
+# --- Password Hashing ---
+# Key derivation is deliberately slow, so it runs in a small process pool instead of
+# on request threads. When too many hashes are already waiting, requests are rejected
+# immediately rather than queueing behind a login storm.
+# Unset keeps werkzeug's default (scrypt), which existing hashes and init_db's admin use.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD')
+PASSWORD_HASH_ARGS = (PASSWORD_HASH_METHOD,) if PASSWORD_HASH_METHOD else ()
+# Set to 0 to hash inline on the request thread (useful as a benchmark baseline).
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 16))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+class PasswordHasherBusy(Exception):
+    """Raised when the password hashing queue is full or a hash took too long."""
+
+@functools.lru_cache(maxsize=None)
+def password_hash_prefix():
+    """The method prefix werkzeug writes for new hashes, e.g. 'scrypt' -> 'scrypt:32768:8:1'.
+
+    Werkzeug fills in default parameters, so the prefix is taken from a real hash,
+    computed once on first use rather than on every cold start.
+    """
+    return generate_password_hash('', *PASSWORD_HASH_ARGS).split('$', 1)[0]
+
+class PasswordHasher:
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily, per process, so forked gunicorn workers don't share a pool.
+        # Request threads may hold locks by then, so pool workers are started from a
+        # forkserver rather than forked from this process.
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('forkserver'))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, func, *args):
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the job has actually left the pool, so abandoned
+        # jobs still count against PASSWORD_HASH_MAX_PENDING.
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, *PASSWORD_HASH_ARGS)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    @staticmethod
+    def needs_rehash(password_hash):
+        """True when a stored hash was made with different parameters than the current ones."""
+        return password_hash.split('$', 1)[0] != password_hash_prefix()
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT)
+
+@app.errorhandler(PasswordHasherBusy)
+def handle_password_hasher_busy(e):
+    response = jsonify({'error': 'Too many authentication requests, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# --- Admission Control ---
+# Per-route concurrency limits plus per-client token buckets for expensive endpoints.
+# Buckets live in-process by default; ADMISSION_SHARED_STATE=postgres shares them
+# between workers and instances through the rate_limit_buckets table.
+ADMISSION_SHARED_STATE = os.getenv('ADMISSION_SHARED_STATE', 'memory')
+ADMISSION_POLICIES = {
+    # name: concurrent requests per worker, seconds to wait for a slot, then each client's
+    # tokens per second and bucket size. 'auth' allows a few retries, then 6 attempts a minute.
+    'auth': {'concurrency': 8, 'queue_timeout': 0.5, 'rate': 0.1, 'burst': 5},
+    'invoice': {'concurrency': 4, 'queue_timeout': 2.0, 'rate': 0.5, 'burst': 5},
+    'table_dump': {'concurrency': 2, 'queue_timeout': 0, 'rate': 0.5, 'burst': 5},
+    'upload': {'concurrency': 4, 'queue_timeout': 1.0, 'rate': 1.0, 'burst': 10},
+}
+ADMISSION_POLICIES.update(json.loads(os.getenv('ADMISSION_POLICIES_JSON', '{}')))
+MAX_TRACKED_CLIENTS = 10000
+# Shared with the Next.js server so it can vouch for the client address it forwards.
+INTERNAL_API_TOKEN = os.getenv('INTERNAL_API_TOKEN')
+if TRUSTED_PROXY_HOPS and not INTERNAL_API_TOKEN:
+    # Deployed behind a proxy, every login relayed by Next.js would share one bucket.
+    raise RuntimeError("INTERNAL_API_TOKEN must be set when TRUSTED_PROXY_HOPS is.")
+if not INTERNAL_API_TOKEN:
+    app.logger.warning("INTERNAL_API_TOKEN is not set: requests relayed by the Next.js server share one rate-limit bucket.")
+
+class MemoryTokenBuckets:
+    """In-process token buckets keyed by policy and client, with LRU eviction."""
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Takes one token. Returns 0 if admitted, else the seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+class PostgresTokenBuckets:
+    """Token buckets shared through Postgres; time is taken from the database clock."""
+
+    def take(self, key, rate, burst):
+        conn = get_db_connection(primary=True)
+        if not conn:
+            return 0 # Fail open: the limiter must not take the site down with the database.
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""INSERT INTO rate_limit_buckets (key, tokens, updated_at)
+                                  VALUES (%s, %s, clock_timestamp()) ON CONFLICT (key) DO NOTHING""", (key, burst))
+                cursor.execute("""SELECT tokens, EXTRACT(EPOCH FROM clock_timestamp() - updated_at)
+                                  FROM rate_limit_buckets WHERE key = %s FOR UPDATE""", (key,))
+                tokens, elapsed = cursor.fetchone()
+                tokens = min(burst, tokens + float(elapsed) * rate)
+                wait = 0 if tokens >= 1 else (1 - tokens) / rate
+                if not wait:
+                    tokens -= 1
+                cursor.execute("UPDATE rate_limit_buckets SET tokens = %s, updated_at = clock_timestamp() WHERE key = %s",
+                               (tokens, key))
+            conn.commit()
+            return wait
+        except psycopg2.Error as e:
+            app.logger.warning(f"Shared rate limit unavailable, admitting request: {e}")
+            return 0
+        finally:
+            conn.close()
+
+token_buckets = PostgresTokenBuckets() if ADMISSION_SHARED_STATE == 'postgres' else MemoryTokenBuckets(MAX_TRACKED_CLIENTS)
+admission_slots = {name: threading.BoundedSemaphore(policy['concurrency']) for name, policy in ADMISSION_POLICIES.items()}
+admission_stats = {name: {'admitted': 0, 'queued': 0, 'shed_concurrency': 0, 'shed_rate': 0} for name in ADMISSION_POLICIES}
+admission_stats_lock = threading.Lock()
+
+def count_admission(name, outcome):
+    with admission_stats_lock:
+        admission_stats[name][outcome] += 1
+
+def client_key():
+    """The end user's address, used to key per-client token buckets.
+
+    Most traffic reaches the API through the Next.js server (server actions and the
+    /api rewrite), so remote_addr is the Next server for every user. Next vouches for
+    its requests with the shared INTERNAL_API_TOKEN and forwards the user's address
+    in X-Client-IP when it knows it from a trusted source. A vouched request without
+    one returns None rather than the relay's own address; anything unvouched is keyed
+    on the (ProxyFix-resolved) peer.
+    """
+    token = request.headers.get('X-Internal-Token', '')
+    if INTERNAL_API_TOKEN and hmac.compare_digest(token.encode('utf-8'), INTERNAL_API_TOKEN.encode('utf-8')):
+        client_ip = request.headers.get('X-Client-IP', '').strip()
+        return client_ip or None
+    return request.remote_addr
+
+def too_many_requests(retry_after):
+    response = jsonify({'error': 'Too many requests, please retry later'})
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, 429
+
+def admission_control(name, methods=None):
+    """Limits a route with the named policy; only the listed methods are limited when given."""
+    policy = ADMISSION_POLICIES[name]
+    slots = admission_slots[name]
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if methods and request.method not in methods:
+                return view(*args, **kwargs)
+
+            # Relayed requests with no known client address are only bounded by concurrency.
+            client = client_key()
+            wait = token_buckets.take(f"{name}:{client}", policy['rate'], policy['burst']) if client else 0
+            if wait:
+                count_admission(name, 'shed_rate')
+                return too_many_requests(wait)
+
+            if not slots.acquire(blocking=False):
+                if policy['queue_timeout']:
+                    count_admission(name, 'queued')
+                if not policy['queue_timeout'] or not slots.acquire(timeout=policy['queue_timeout']):
+                    count_admission(name, 'shed_concurrency')
+                    return too_many_requests(1)
+            count_admission(name, 'admitted')
+            try:
+                return view(*args, **kwargs)
+            finally:
+                slots.release()
+        return wrapper
+    return decorator
+
+# --- Invoice Document Stack ---
+# qrcode, python-docx and Pillow are only used by the invoice route, so they are
+# imported on first use instead of on every cold start and worker boot.
+@functools.lru_cache(maxsize=None)
+def invoice_modules():
+    import qrcode
+    from docx import Document
+    from docx.shared import Inches
+    return qrcode, Document, Inches
+
+def warm_up():
+    """Loads lazily-imported modules ahead of the first request that needs them."""
+    invoice_modules()
+
+# Set WARM_UP_ON_START=1 to pay the import cost at boot (e.g. with gunicorn --preload,
+# so forked workers share the loaded modules).
+if os.getenv('WARM_UP_ON_START') == '1':
+    warm_up()
+
+# --- Category Facets ---
+# product_category_facets holds per-category counts and price ranges. Every write
+# that can change them refreshes only the categories it touched, using the
+# products(category) index, so reading facets never scans the catalog.
+PRODUCT_FACET_FIELDS = ('category', 'price', 'stock')
+
+def refresh_category_facets(cursor, categories):
+    categories = sorted({category for category in categories if category is not None})
+    if not categories:
+        return
+    # Every category needs a row to lock, or two first writers to a new category
+    # could both recount without waiting for each other.
+    cursor.execute("""
+        INSERT INTO product_category_facets (category)
+        SELECT unnest(%s::text[]) ORDER BY 1
+        ON CONFLICT (category) DO NOTHING
+    """, (categories,))
+    # Serialize refreshes per category so the recount below sees other writers' committed changes.
+    cursor.execute("SELECT category FROM product_category_facets WHERE category = ANY(%s) ORDER BY category FOR UPDATE",
+                   (categories,))
+    # Emptied categories keep a zero row rather than being deleted, so there is always a row to lock.
+    cursor.execute("""
+        UPDATE product_category_facets f SET
+        product_count = counts.product_count,
+        in_stock_count = counts.in_stock_count,
+        min_price = counts.min_price,
+        max_price = counts.max_price,
+        updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT c.category, COUNT(p.id) AS product_count, COUNT(p.id) FILTER (WHERE p.stock > 0) AS in_stock_count,
+                   MIN(p.price) AS min_price, MAX(p.price) AS max_price
+            FROM unnest(%s::text[]) AS c(category)
+            LEFT JOIN products p ON p.category = c.category
+            GROUP BY c.category
+        ) AS counts
+        WHERE f.category = counts.category
+    """, (categories,))
+
+def locked_product_category(cursor, product_id):
+    """Returns a product's current category, locking the row until the transaction ends."""
+    cursor.execute("SELECT category FROM products WHERE id = %s FOR UPDATE", (product_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# --- Partial Product Updates ---
+# Request field -> products column for PATCH. Fields that are absent are left untouched.
+PRODUCT_PATCH_FIELDS = {
+    'name': 'name',
+    'description': 'description',
+    'category': 'category',
+    'price': 'price',
+    'discount': 'discount',
+    'stock': 'stock',
+    'isFeatured': 'is_featured',
+}
+MAX_PRODUCT_IMAGES = 4
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('on', 'true', '1', 'yes')
+
+def build_image_slots_sql(cursor, slots, files):
+    """Builds a SQL expression for the new `images` array from slot references.
+
+    Each slot is one of {"keep": <index of an existing image>}, {"url": "..."}
+    or {"file": "<multipart field name>"}; slots that are left out are removed.
+    Kept images are copied inside Postgres, so the client never re-sends them.
+    """
+    if not isinstance(slots, list) or len(slots) > MAX_PRODUCT_IMAGES:
+        raise ValueError(f"imageSlots must be a list of at most {MAX_PRODUCT_IMAGES} slots")
+
+    elements = []
+    values = []
+    for slot in slots:
+        if not isinstance(slot, dict):
+            raise ValueError("Each image slot must be an object")
+        if 'keep' in slot:
+            keep_index = slot['keep']
+            # Exact int only: bool is an int subclass, and floats like 1.9 would truncate.
+            if type(keep_index) is not int or keep_index < 0:
+                raise ValueError("'keep' must be the index of an existing image")
+            elements.append(pg_sql.SQL("images->%s"))
+            values.append(keep_index)
+        elif slot.get('url'):
+            elements.append(pg_sql.SQL("to_jsonb(%s::text)"))
+            values.append(slot['url'])
+        elif slot.get('file'):
+            image_url = store_uploaded_image(cursor, files.get(slot['file']))
+            if not image_url:
+                raise ValueError(f"Invalid or missing image file '{slot['file']}'")
+            elements.append(pg_sql.SQL("to_jsonb(%s::text)"))
+            values.append(image_url)
+        else:
+            raise ValueError("Image slots need one of 'keep', 'url' or 'file'")
+
+    if not elements:
+        return pg_sql.SQL("'[]'::jsonb"), values
+    # Out-of-range "keep" indexes yield NULL and are dropped rather than stored.
+    expression = pg_sql.SQL(
+        "(SELECT COALESCE(jsonb_agg(slot ORDER BY position), '[]'::jsonb) "
+        "FROM unnest(ARRAY[{}]) WITH ORDINALITY AS s(slot, position) WHERE slot IS NOT NULL)"
+    ).format(pg_sql.SQL(', ').join(elements))
+    return expression, values
+
+def build_product_patch(cursor, data, files):
+    """Returns the SET clause and values for the columns present in a PATCH request."""
+    assignments = []
+    values = []
+    for field, column in PRODUCT_PATCH_FIELDS.items():
+        if field not in data:
+            continue
+        value = data.get(field)
+        if column == 'is_featured':
+            value = parse_bool(value)
+        assignments.append(pg_sql.SQL("{} = %s").format(pg_sql.Identifier(column)))
+        values.append(value)
+
+    if 'imageSlots' in data:
+        slots = data.get('imageSlots')
+        if isinstance(slots, str):
+            slots = json.loads(slots)
+        expression, slot_values = build_image_slots_sql(cursor, slots, files)
+        assignments.append(pg_sql.SQL("images = {}").format(expression))
+        values.extend(slot_values)
+
+    return assignments, values
+
+# --- Store Location Helpers ---
+# Columns for store lists; the map embed and image are only needed on detail views.
+STORE_SUMMARY_COLUMNS = "id, name, address, city, phone, hours, latitude, longitude"
+MAX_NEAREST_STORES = 50
+
+def store_coordinates(data):
+    """Uses explicit latitude/longitude fields when both are valid, else parses the map embed URL."""
+    latitude, longitude = parse_coordinates(data.get('latitude'), data.get('longitude'))
+    if latitude is not None:
+        return latitude, longitude
+    return parse_map_embed_coordinates(data.get('mapEmbedUrl'))
+
+# --- Hero Slide Helpers ---
+HERO_SLIDE_COLUMNS = "id, position, headline, subheadline, button_text, updated_at"
+# A short hash of an embedded image, computed in Postgres so the image itself isn't fetched.
+HERO_SLIDE_IMAGE_VERSION = "CASE WHEN left(image_url, 5) = 'data:' THEN left(md5(image_url), 16) END AS image_version"
+
+def hero_slide_image_ref(slide_id, image_url, image_version):
+    """Returns the URL clients should load a slide image from.
+
+    Embedded data-URI images are served by the per-slide image endpoint so the
+    settings payload stays small; plain URLs are passed through untouched. The
+    version changes with the image content, not the edit time, so two saves within
+    a second still produce different URLs.
+    """
+    if image_url and image_url.startswith('data:'):
+        return url_for('get_hero_slide_image', slide_id=slide_id, v=image_version)
+    return image_url
+
+def is_hero_slide_image_ref(image_url, slide_id):
+    return bool(image_url) and url_for('get_hero_slide_image', slide_id=slide_id) in image_url
+
+def hero_slide_to_dict(row):
+    return {
+        'id': row['id'],
+        'position': row['position'],
+        'headline': row['headline'],
+        'subheadline': row['subheadline'],
+        'buttonText': row['button_text'],
+        'imageUrl': hero_slide_image_ref(row['id'], row['image_url'], row['image_version']),
+    }
+
+def load_hero_slides(cursor):
+    """Loads slide metadata in display order without pulling embedded image data."""
+    cursor.execute(f"""SELECT {HERO_SLIDE_COLUMNS}, {HERO_SLIDE_IMAGE_VERSION},
+                              CASE WHEN image_url LIKE 'data:%' THEN 'data:' ELSE image_url END AS image_url
+                       FROM hero_slides ORDER BY position, id""")
+    return [hero_slide_to_dict(row) for row in cursor.fetchall()]
+
+def upsert_hero_slide(cursor, slide_id, position, headline, subheadline, button_text, image_url):
+    """Writes one slide. image_url=None keeps the stored image; unchanged slides are not rewritten."""
+    sql = """INSERT INTO hero_slides (id, position, headline, subheadline, button_text, image_url)
+             VALUES (%s, %s, %s, %s, %s, COALESCE(%s, ''))
+             ON CONFLICT (id) DO UPDATE SET
+             position = EXCLUDED.position,
+             headline = EXCLUDED.headline,
+             subheadline = EXCLUDED.subheadline,
+             button_text = EXCLUDED.button_text,
+             image_url = COALESCE(%s, hero_slides.image_url),
+             updated_at = CURRENT_TIMESTAMP
+             WHERE (hero_slides.position, hero_slides.headline, hero_slides.subheadline, hero_slides.button_text)
+                   IS DISTINCT FROM (EXCLUDED.position, EXCLUDED.headline, EXCLUDED.subheadline, EXCLUDED.button_text)
+                OR (%s IS NOT NULL AND hero_slides.image_url IS DISTINCT FROM %s)"""
+    cursor.execute(sql, (slide_id, position, headline, subheadline, button_text, image_url,
+                         image_url, image_url, image_url))
+
 # --- API Routes ---
 
 @app.route('/api/register', methods=['POST'])
+@admission_control('auth')
 def register_user():
     data = request.get_json()
     if not data or not data.get('name') or not data.get('email') or not data.get('password'):
         return jsonify({'error': 'Missing required fields'}), 400
 
-    hashed_password = generate_password_hash(data['password'])
+    hashed_password = password_hasher.hash(data['password'])
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
     try:
@@ -92,6 +876,7 @@ def register_user():
             conn.close()
 
 @app.route('/api/login', methods=['POST'])
+@admission_control('auth')
 def login_user():
     data = request.get_json()
     if not data or not data.get('email') or not data.get('password'):
@@ -104,7 +889,16 @@ def login_user():
             sql = "SELECT * FROM users WHERE email = %s AND role = 'admin'"
             cursor.execute(sql, (data['email'],))
             user = cursor.fetchone()
-            if user and check_password_hash(user['password_hash'], data['password']):
+            if user and password_hasher.verify(user['password_hash'], data['password']):
+                if password_hasher.needs_rehash(user['password_hash']):
+                    # Best effort: valid credentials must not fail because the hasher is busy.
+                    try:
+                        new_hash = password_hasher.hash(data['password'])
+                    except PasswordHasherBusy:
+                        new_hash = None
+                    if new_hash:
+                        cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user['id']))
+                        conn.commit()
                 return jsonify({'message': 'Login successful', 'user': {'name': user['name'], 'email': user['email']}}), 200
             else:
                 return jsonify({'error': 'Invalid credentials or not an admin'}), 401
@@ -113,54 +907,69 @@ def login_user():
             conn.close()
 
 @app.route('/api/products', methods=['GET', 'POST'])
+@replica_reads()
+@admission_control('upload', methods=('POST', 'PUT', 'PATCH'))
 def handle_products():
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
     try:
         if request.method == 'POST':
-            image_uris = []
-            for i in range(1, 5):
-                file_key = f'image{i}'
-                url_key = f'imageUrl{i}'
-
-                # Prioritize file upload
-                if file_key in request.files and request.files[file_key].filename:
-                    file = request.files[file_key]
-                    data_uri = file_to_data_uri(file)
-                    if data_uri:
-                        image_uris.append(data_uri)
-                # Fallback to URL if provided
-                elif request.form.get(url_key):
-                    image_uris.append(request.form.get(url_key))
-            
-            product_data = {
-                'id': str(uuid.uuid4()),
-                'name': request.form.get('name'),
-                'description': request.form.get('description'),
-                'category': request.form.get('category'),
-                'price': request.form.get('price'),
-                'discount': request.form.get('discount', 0),
-                'stock': request.form.get('stock', 100),
-                'images': json.dumps(image_uris),
-                'is_featured': request.form.get('isFeatured') == 'on'
-            }
             with conn.cursor() as cursor:
+                image_urls = []
+                for i in range(1, 5):
+                    file_key = f'image{i}'
+                    url_key = f'imageUrl{i}'
+
+                    # Prioritize file upload
+                    if file_key in request.files and request.files[file_key].filename:
+                        image_url = store_uploaded_image(cursor, request.files[file_key])
+                        if image_url:
+                            image_urls.append(image_url)
+                    # Fallback to URL if provided
+                    elif request.form.get(url_key):
+                        image_urls.append(request.form.get(url_key))
+
+                product_data = {
+                    'id': str(uuid.uuid4()),
+                    'name': request.form.get('name'),
+                    'description': request.form.get('description'),
+                    'category': request.form.get('category'),
+                    'price': request.form.get('price'),
+                    'discount': request.form.get('discount', 0),
+                    'stock': request.form.get('stock', 100),
+                    'images': json.dumps(image_urls),
+                    'is_featured': request.form.get('isFeatured') == 'on'
+                }
                 sql = """INSERT INTO products (id, name, description, category, price, discount, stock, images, is_featured) 
                          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
                 cursor.execute(sql, tuple(product_data.values()))
+                refresh_category_facets(cursor, [product_data['category']])
             conn.commit()
+            record_write()
             return jsonify(product_data), 201
         
         # GET Products
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            if 'ids' in request.args:
+                return product_batch_response(cursor, request.args.get('ids'), request.args.get('fields'))
+
+            conditions = []
+            values = []
             query = request.args.get('q')
             if query:
                 search_term = f"%{query}%"
-                sql = "SELECT * FROM products WHERE name ILIKE %s OR category ILIKE %s ORDER BY created_at DESC"
-                cursor.execute(sql, (search_term, search_term))
-            else:
-                sql = "SELECT * FROM products ORDER BY created_at DESC"
-                cursor.execute(sql)
+                conditions.append("(name ILIKE %s OR category ILIKE %s)")
+                values.extend([search_term, search_term])
+            category = request.args.get('category')
+            if category:
+                conditions.append("category = %s")
+                values.append(category)
+
+            sql = "SELECT * FROM products"
+            if conditions:
+                sql += " WHERE " + " AND ".join(conditions)
+            sql += " ORDER BY created_at DESC"
+            cursor.execute(sql, values)
             
             products = [dict(row) for row in cursor.fetchall()]
             return jsonify(products)
@@ -168,7 +977,46 @@ def handle_products():
         if conn:
             conn.close()
 
-@app.route('/api/products/<string:product_id>', methods=['GET', 'PUT', 'DELETE'])
+@app.route('/api/products/facets', methods=['GET'])
+@replica_reads()
+def get_product_facets():
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute("""SELECT category, product_count, in_stock_count, min_price, max_price
+                              FROM product_category_facets WHERE product_count > 0 ORDER BY category""")
+            categories = [dict(row) for row in cursor.fetchall()]
+            return jsonify({
+                'categories': categories,
+                'product_count': sum(row['product_count'] for row in categories),
+                'in_stock_count': sum(row['in_stock_count'] for row in categories),
+                'min_price': min((row['min_price'] for row in categories), default=None),
+                'max_price': max((row['max_price'] for row in categories), default=None),
+            })
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/products/lookup', methods=['POST'])
+@replica_reads(methods=('POST',))
+def lookup_products():
+    data = request.get_json()
+    if not data or not isinstance(data.get('ids'), list):
+        return jsonify({'error': 'A list of ids is required'}), 400
+
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            return product_batch_response(cursor, data['ids'], data.get('fields'))
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/products/<string:product_id>', methods=['GET', 'PUT', 'PATCH', 'DELETE'])
+@replica_reads()
+@admission_control('upload', methods=('POST', 'PUT', 'PATCH'))
 def handle_product(product_id):
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
@@ -190,13 +1038,14 @@ def handle_product(product_id):
                     # Prioritize new file upload
                     if file_key in request.files and request.files[file_key].filename:
                         file = request.files[file_key]
-                        data_uri = file_to_data_uri(file)
-                        if data_uri:
-                            new_image_uris.append(data_uri)
+                        uploaded_url = store_uploaded_image(cursor, file)
+                        if uploaded_url:
+                            new_image_uris.append(uploaded_url)
                     # Fallback to existing URL
                     elif request.form.get(url_key):
                         new_image_uris.append(request.form.get(url_key))
                 
+                old_category = locked_product_category(cursor, product_id)
                 sql = """UPDATE products SET name=%s, description=%s, category=%s, price=%s, discount=%s, stock=%s, images=%s, is_featured=%s
                          WHERE id=%s"""
                 values = (
@@ -205,18 +1054,50 @@ def handle_product(product_id):
                     json.dumps(new_image_uris), request.form.get('isFeatured') == 'on', product_id
                 )
                 cursor.execute(sql, values)
+                refresh_category_facets(cursor, [old_category, request.form.get('category')])
                 conn.commit()
+                record_write()
                 return jsonify({'message': 'Product updated successfully'})
 
+            elif request.method == 'PATCH':
+                data = request.form if request.form else (request.get_json(silent=True) or {})
+                try:
+                    assignments, values = build_product_patch(cursor, data, request.files)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                if not assignments:
+                    return jsonify({'error': 'No fields to update'}), 400
+
+                affects_facets = any(field in data for field in PRODUCT_FACET_FIELDS)
+                old_category = locked_product_category(cursor, product_id) if affects_facets else None
+                returning = PRODUCT_SUMMARY_COLUMNS if request.args.get('fields') == 'summary' else "*"
+                query = pg_sql.SQL("UPDATE products SET {} WHERE id = %s RETURNING {}").format(
+                    pg_sql.SQL(', ').join(assignments), pg_sql.SQL(returning))
+                cursor.execute(query, values + [product_id])
+                product = cursor.fetchone()
+                if not product:
+                    conn.rollback()
+                    return jsonify({'error': 'Product not found'}), 404
+                if affects_facets:
+                    refresh_category_facets(cursor, [old_category, product['category']])
+                conn.commit()
+                record_write()
+                return jsonify(dict(product))
+
             elif request.method == 'DELETE':
-                cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
+                cursor.execute("DELETE FROM products WHERE id = %s RETURNING category", (product_id,))
+                deleted = cursor.fetchone()
+                if deleted:
+                    refresh_category_facets(cursor, [deleted['category']])
                 conn.commit()
+                record_write()
                 return jsonify({'message': 'Product deleted'})
     finally:
         if conn:
             conn.close()
 
 @app.route('/api/admins', methods=['GET', 'POST'])
+@replica_reads()
 def handle_admins():
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
@@ -226,10 +1107,11 @@ def handle_admins():
                 data = request.get_json()
                 if not data or not data.get('name') or not data.get('email') or not data.get('password'):
                     return jsonify({'error': 'Missing required fields'}), 400
-                hashed_password = generate_password_hash(data['password'])
+                hashed_password = password_hasher.hash(data['password'])
                 sql = "INSERT INTO users (name, email, password_hash, role) VALUES (%s, %s, %s, 'admin')"
                 cursor.execute(sql, (data['name'], data['email'], hashed_password))
                 conn.commit()
+                record_write()
                 return jsonify({'name': data['name'], 'email': data['email']}), 201
             
             # GET Admins
@@ -264,12 +1146,15 @@ def handle_admin(admin_id):
             if rows_affected == 0:
                 return jsonify({'error': 'Administrator not found'}), 404
             conn.commit()
+            record_write()
             return jsonify({'message': 'Administrator deleted successfully'})
     finally:
         if conn:
             conn.close()
 
 @app.route('/api/settings', methods=['GET', 'POST'])
+@replica_reads()
+@admission_control('upload', methods=('POST', 'PUT', 'PATCH'))
 def handle_settings():
     conn = get_db_connection()
     if not conn:
@@ -277,34 +1162,30 @@ def handle_settings():
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
             if request.method == 'POST':
-                # Reconstruct hero slides data from form fields and files
-                hero_slides = []
-                slides_data = json.loads(request.form.get('heroImagesData', '[]'))
-                
-                for i, slide_data in enumerate(slides_data):
-                    file_key = f'heroImageFile_{i}'
-                    new_slide = {
-                        'id': slide_data.get('id'),
-                        'headline': slide_data.get('headline'),
-                        'subheadline': slide_data.get('subheadline'),
-                        'buttonText': slide_data.get('buttonText'),
-                        'imageUrl': slide_data.get('imageUrl') # Keep existing image by default
-                    }
-                    
-                    if file_key in request.files and request.files[file_key].filename:
-                        file = request.files[file_key]
-                        data_uri = file_to_data_uri(file)
-                        if data_uri:
-                            new_slide['imageUrl'] = data_uri
-                    
-                    hero_slides.append(new_slide)
+                # Sync hero slides one by one; only new or edited slides are written.
+                if 'heroImagesData' in request.form:
+                    slides_data = json.loads(request.form.get('heroImagesData') or '[]')
+                    slide_ids = []
+                    for i, slide_data in enumerate(slides_data):
+                        slide_id = slide_data.get('id') or str(uuid.uuid4())
+                        image_url = slide_data.get('imageUrl')
+                        if is_hero_slide_image_ref(image_url, slide_id):
+                            image_url = None # Keep the stored image
+
+                        file_key = f'heroImageFile_{i}'
+                        if file_key in request.files and request.files[file_key].filename:
+                            uploaded_url = store_uploaded_image(cursor, request.files[file_key])
+                            if uploaded_url:
+                                image_url = uploaded_url
 
-                hero_images_json = json.dumps(hero_slides)
+                        upsert_hero_slide(cursor, slide_id, i, slide_data.get('headline'),
+                                          slide_data.get('subheadline'), slide_data.get('buttonText'), image_url)
+                        slide_ids.append(slide_id)
+                    cursor.execute("DELETE FROM hero_slides WHERE NOT (id = ANY(%s))", (slide_ids,))
 
-                sql = """INSERT INTO settings (id, hero_images, featured_collection_title, featured_collection_description, promo_section_title, promo_section_description, promo_section_video_url, phone, contact_email, twitter_url, instagram_url, facebook_url, notifications_enabled)
-                         VALUES (1, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                sql = """INSERT INTO settings (id, featured_collection_title, featured_collection_description, promo_section_title, promo_section_description, promo_section_video_url, phone, contact_email, twitter_url, instagram_url, facebook_url, notifications_enabled)
+                         VALUES (1, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                          ON CONFLICT (id) DO UPDATE SET
-                         hero_images = EXCLUDED.hero_images,
                          featured_collection_title = EXCLUDED.featured_collection_title,
                          featured_collection_description = EXCLUDED.featured_collection_description,
                          promo_section_title = EXCLUDED.promo_section_title,
@@ -318,7 +1199,6 @@ def handle_settings():
                          notifications_enabled = EXCLUDED.notifications_enabled
                          RETURNING *"""
                 values = (
-                    hero_images_json,
                     request.form.get('featuredCollectionTitle'),
                     request.form.get('featuredCollectionDescription'),
                     request.form.get('promoSectionTitle'),
@@ -333,14 +1213,18 @@ def handle_settings():
                 )
                 cursor.execute(sql, values)
                 settings = dict(cursor.fetchone())
+                settings['hero_images'] = load_hero_slides(cursor)
                 conn.commit()
+                record_write()
                 return jsonify(settings)
             
             # GET request
             cursor.execute("SELECT * FROM settings WHERE id = 1")
             settings = cursor.fetchone()
             if settings:
-                return jsonify(dict(settings))
+                settings = dict(settings)
+                settings['hero_images'] = load_hero_slides(cursor)
+                return jsonify(settings)
             # Return default empty object if no settings found, client will handle it
             return jsonify({}), 200
     except Exception as e:
@@ -350,6 +1234,112 @@ def handle_settings():
         if conn:
             conn.close()
 
+@app.route('/api/hero-slides/<string:slide_id>', methods=['GET', 'PUT', 'DELETE'])
+@replica_reads()
+@admission_control('upload', methods=('POST', 'PUT', 'PATCH'))
+def handle_hero_slide(slide_id):
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            if request.method == 'PUT':
+                data = request.form
+                image_url = data.get('imageUrl')
+                if is_hero_slide_image_ref(image_url, slide_id):
+                    image_url = None # Keep the stored image
+                if 'imageFile' in request.files and request.files['imageFile'].filename:
+                    uploaded_url = store_uploaded_image(cursor, request.files['imageFile'])
+                    if uploaded_url:
+                        image_url = uploaded_url
+
+                position = data.get('position', type=int)
+                if position is None:
+                    cursor.execute("SELECT position FROM hero_slides WHERE id = %s", (slide_id,))
+                    existing = cursor.fetchone()
+                    if existing:
+                        position = existing['position']
+                    else:
+                        cursor.execute("SELECT COALESCE(MAX(position) + 1, 0) AS position FROM hero_slides")
+                        position = cursor.fetchone()['position']
+
+                upsert_hero_slide(cursor, slide_id, position, data.get('headline'),
+                                  data.get('subheadline'), data.get('buttonText'), image_url)
+                conn.commit()
+                record_write()
+
+            elif request.method == 'DELETE':
+                cursor.execute("DELETE FROM hero_slides WHERE id = %s", (slide_id,))
+                if cursor.rowcount == 0:
+                    return jsonify({'error': 'Slide not found'}), 404
+                conn.commit()
+                record_write()
+                return jsonify({'message': 'Slide deleted'})
+
+            cursor.execute(f"SELECT {HERO_SLIDE_COLUMNS}, {HERO_SLIDE_IMAGE_VERSION}, image_url FROM hero_slides WHERE id = %s",
+                           (slide_id,))
+            slide = cursor.fetchone()
+            if not slide:
+                return jsonify({'error': 'Slide not found'}), 404
+            return jsonify(hero_slide_to_dict(slide))
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/hero-slides/<string:slide_id>/image', methods=['GET'])
+@replica_reads()
+def get_hero_slide_image(slide_id):
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT image_url FROM hero_slides WHERE id = %s", (slide_id,))
+            row = cursor.fetchone()
+    finally:
+        if conn:
+            conn.close()
+
+    if not row or not row[0]:
+        return jsonify({'error': 'Slide image not found'}), 404
+    image_url = row[0]
+    if not image_url.startswith('data:'):
+        return redirect(image_url)
+
+    header, _, encoded = image_url.partition(',')
+    mimetype = header[len('data:'):].split(';')[0] or 'application/octet-stream'
+    try:
+        image_data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        app.logger.warning(f"Hero slide '{slide_id}' has a malformed data URI image.")
+        return jsonify({'error': 'Slide image not found'}), 404
+    response = send_file(io.BytesIO(image_data), mimetype=mimetype)
+    if request.args.get('v'):
+        # Versioned URLs change whenever the slide is edited, so they can be cached indefinitely.
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/api/images/<string:sha256>', methods=['GET'])
+@replica_reads()
+def get_image(sha256):
+    if len(sha256) != 64 or not all(c in '0123456789abcdef' for c in sha256):
+        return jsonify({'error': 'Invalid image id'}), 400
+
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT mimetype, data FROM image_blobs WHERE sha256 = %s", (sha256,))
+            row = cursor.fetchone()
+    finally:
+        if conn:
+            conn.close()
+
+    if not row:
+        return jsonify({'error': 'Image not found'}), 404
+    response = send_file(io.BytesIO(row[1]), mimetype=row[0], etag=sha256)
+    # Images are content-addressed, so a URL always refers to the same bytes.
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/api/notifications', methods=['POST'])
 def create_notification():
     data = request.get_json()
@@ -371,6 +1361,7 @@ def create_notification():
             conn.close()
 
 @app.route('/api/notifications/latest', methods=['GET'])
+@replica_reads()
 def get_latest_notification():
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
@@ -386,6 +1377,8 @@ def get_latest_notification():
             conn.close()
 
 @app.route('/api/stores', methods=['GET', 'POST'])
+@replica_reads()
+@admission_control('upload', methods=('POST', 'PUT', 'PATCH'))
 def handle_stores():
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
@@ -396,20 +1389,50 @@ def handle_stores():
                 image_url = data.get('imageUrl', '') # Default to empty or provided URL
                 if 'imageFile' in request.files and request.files['imageFile'].filename:
                     file = request.files['imageFile']
-                    data_uri = file_to_data_uri(file)
-                    if data_uri:
-                        image_url = data_uri
+                    uploaded_url = store_uploaded_image(cursor, file)
+                    if uploaded_url:
+                        image_url = uploaded_url
                 
-                sql = """INSERT INTO store_locations (name, address, city, phone, hours, map_embed_url, image_url)
-                         VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING *"""
-                values = (data.get('name'), data.get('address'), data.get('city'), data.get('phone'), data.get('hours'), data.get('mapEmbedUrl'), image_url)
+                latitude, longitude = store_coordinates(data)
+                sql = """INSERT INTO store_locations (name, address, city, phone, hours, map_embed_url, image_url, latitude, longitude)
+                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *"""
+                values = (data.get('name'), data.get('address'), data.get('city'), data.get('phone'), data.get('hours'), data.get('mapEmbedUrl'), image_url, latitude, longitude)
                 cursor.execute(sql, values)
                 new_store = dict(cursor.fetchone())
                 conn.commit()
+                record_write()
                 return jsonify(new_store), 201
 
             # GET all stores
-            cursor.execute("SELECT * FROM store_locations ORDER BY id")
+            columns = STORE_SUMMARY_COLUMNS if request.args.get('fields') == 'summary' else "*"
+            cursor.execute(f"SELECT {columns} FROM store_locations ORDER BY id")
+            stores = [dict(row) for row in cursor.fetchall()]
+            return jsonify(stores)
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/stores/nearest', methods=['GET'])
+@replica_reads()
+def get_nearest_stores():
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    if latitude is None or longitude is None or not valid_coordinates(latitude, longitude):
+        return jsonify({'error': 'Valid lat and lon query parameters are required'}), 400
+    k = min(max(request.args.get('k', 3, type=int), 1), MAX_NEAREST_STORES)
+
+    conn = get_db_connection()
+    if not conn: return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            # The <-> ordering is served by the GiST index on ll_to_earth(latitude, longitude).
+            sql = f"""SELECT {STORE_SUMMARY_COLUMNS},
+                             earth_distance(ll_to_earth(latitude, longitude), ll_to_earth(%s, %s)) / 1000 AS distance_km
+                      FROM store_locations
+                      WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                      ORDER BY ll_to_earth(latitude, longitude) <-> ll_to_earth(%s, %s)
+                      LIMIT %s"""
+            cursor.execute(sql, (latitude, longitude, latitude, longitude, k))
             stores = [dict(row) for row in cursor.fetchall()]
             return jsonify(stores)
     finally:
@@ -417,6 +1440,7 @@ def handle_stores():
             conn.close()
 
 @app.route('/api/stores/<int:store_id>', methods=['PUT', 'DELETE'])
+@admission_control('upload', methods=('POST', 'PUT', 'PATCH'))
 def handle_store(store_id):
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
@@ -430,27 +1454,31 @@ def handle_store(store_id):
                 # If a new file is uploaded, it takes precedence
                 if 'imageFile' in request.files and request.files['imageFile'].filename:
                     file = request.files['imageFile']
-                    data_uri = file_to_data_uri(file)
-                    if data_uri:
-                        image_url = data_uri
+                    uploaded_url = store_uploaded_image(cursor, file)
+                    if uploaded_url:
+                        image_url = uploaded_url
                 
-                sql = """UPDATE store_locations SET name=%s, address=%s, city=%s, phone=%s, hours=%s, map_embed_url=%s, image_url=%s
+                latitude, longitude = store_coordinates(data)
+                sql = """UPDATE store_locations SET name=%s, address=%s, city=%s, phone=%s, hours=%s, map_embed_url=%s, image_url=%s, latitude=%s, longitude=%s
                          WHERE id=%s RETURNING *"""
-                values = (data.get('name'), data.get('address'), data.get('city'), data.get('phone'), data.get('hours'), data.get('mapEmbedUrl'), image_url, store_id)
+                values = (data.get('name'), data.get('address'), data.get('city'), data.get('phone'), data.get('hours'), data.get('mapEmbedUrl'), image_url, latitude, longitude, store_id)
                 cursor.execute(sql, values)
                 updated_store = dict(cursor.fetchone())
                 conn.commit()
+                record_write()
                 return jsonify(updated_store)
 
             elif request.method == 'DELETE':
                 cursor.execute("DELETE FROM store_locations WHERE id = %s", (store_id,))
                 conn.commit()
+                record_write()
                 return jsonify({'message': 'Store deleted successfully'})
     finally:
         if conn:
             conn.close()
 
 @app.route('/api/generate-invoice-docx', methods=['POST'])
+@admission_control('invoice')
 def generate_invoice_docx():
     data = request.get_json()
     if not data or not data.get('customerName') or not data.get('items'):
@@ -465,21 +1493,25 @@ def generate_invoice_docx():
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            product_ids = parse_product_ids([item_data.get('productId') for item_data in items])
+            locked_products, missing = fetch_products_by_ids(
+                cursor, product_ids, "id, name, category, price, discount, stock", for_update=True)
+            if missing:
+                raise ValueError(f"Producto con ID {missing[0]} no encontrado.")
+            products = {product['id']: product for product in locked_products}
+            remaining_stock = {product['id']: product['stock'] for product in locked_products}
+
             for item_data in items:
-                product_id = item_data.get('productId')
+                product_id = normalize_product_id(item_data.get('productId'))
+                if product_id not in products:
+                    raise ValueError(f"Producto con ID '{product_id}' no encontrado.")
                 quantity = int(item_data.get('quantity', 1))
+                product = products[product_id]
 
-                cursor.execute("SELECT * FROM products WHERE id = %s FOR UPDATE", (product_id,))
-                product = cursor.fetchone()
+                if remaining_stock[product_id] < quantity:
+                    raise ValueError(f"Stock insuficiente para '{product['name']}'. Disponible: {remaining_stock[product_id]}, Solicitado: {quantity}.")
+                remaining_stock[product_id] -= quantity
 
-                if not product:
-                    raise ValueError(f"Producto con ID {product_id} no encontrado.")
-                if product['stock'] < quantity:
-                    raise ValueError(f"Stock insuficiente para '{product['name']}'. Disponible: {product['stock']}, Solicitado: {quantity}.")
-
-                new_stock = product['stock'] - quantity
-                cursor.execute("UPDATE products SET stock = %s WHERE id = %s", (new_stock, product_id))
-                
                 price = float(product['price'])
                 discount_percent = int(product.get('discount', 0))
                 discounted_price = price - (price * discount_percent / 100)
@@ -492,9 +1524,20 @@ def generate_invoice_docx():
                     "unit_price": discounted_price,
                     "subtotal": subtotal
                 })
+
+            psycopg2.extras.execute_values(
+                cursor,
+                "UPDATE products SET stock = v.stock FROM (VALUES %s) AS v(id, stock) WHERE products.id = v.id",
+                list(remaining_stock.items())
+            )
+            refresh_category_facets(cursor, [product['category'] for product in locked_products])
         conn.commit() # Commit the transaction after all stock updates are calculated
 
-    except (ValueError, psycopg2.Error) as e:
+    except ValueError as e:
+        conn.rollback() # Unknown product, bad quantity or insufficient stock
+        app.logger.warning(f"Rejected invoice request: {e}")
+        return jsonify({'error': str(e)}), 400
+    except psycopg2.Error as e:
         conn.rollback() # Rollback in case of any error during the loop
         app.logger.error(f"Error processing invoice transaction: {e}")
         return jsonify({'error': str(e)}), 500
@@ -503,6 +1546,7 @@ def generate_invoice_docx():
             conn.close()
 
     try:
+        qrcode, Document, Inches = invoice_modules()
         invoice_number = f"INV-{int(datetime.now().timestamp())}"
         qr_url = "https://royal-fernet.vercel.app"
         qr_img = qrcode.make(qr_url)
@@ -563,9 +1607,16 @@ def generate_invoice_docx():
         app.logger.error(f"Error generating DOCX: {e}")
         return jsonify({'error': 'Failed to generate invoice document'}), 500
 
+@app.route('/api/admission/stats', methods=['GET'])
+def get_admission_stats():
+    with admission_stats_lock:
+        stats = {name: dict(counts) for name, counts in admission_stats.items()}
+    return jsonify({'shared_state': ADMISSION_SHARED_STATE, 'policies': ADMISSION_POLICIES, 'stats': stats})
+
 # --- Database Viewer Endpoints ---
 
 @app.route('/api/db/tables', methods=['GET'])
+@replica_reads()
 def get_db_tables():
     conn = get_db_connection()
     if not conn: return jsonify({'error': 'Database connection failed'}), 500
@@ -584,6 +1635,8 @@ def get_db_tables():
             conn.close()
 
 @app.route('/api/db/tables/<string:table_name>', methods=['GET'])
+@replica_reads()
+@admission_control('table_dump')
 def get_table_content(table_name):
     if not table_name.replace('_', '').isalnum():
         return jsonify({'error': 'Invalid table name'}), 400
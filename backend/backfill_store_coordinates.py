@@ -0,0 +1,37 @@
+import logging
+import psycopg2
+import psycopg2.extras
+from init_db import get_db_connection
+from geo import parse_map_embed_coordinates
+
+logging.basicConfig(level=logging.INFO)
+
+def backfill_store_coordinates(overwrite=False):
+    """Fills store_locations.latitude/longitude from each store's Google Maps embed URL."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            sql = "SELECT id, name, map_embed_url FROM store_locations"
+            if not overwrite:
+                sql += " WHERE latitude IS NULL OR longitude IS NULL"
+            cursor.execute(sql)
+            stores = cursor.fetchall()
+
+            updates = []
+            for store in stores:
+                latitude, longitude = parse_map_embed_coordinates(store['map_embed_url'])
+                if latitude is None:
+                    print(f"   - Could not find coordinates for store '{store['name']}' (id {store['id']}).")
+                    continue
+                updates.append((latitude, longitude, store['id']))
+
+            cursor.executemany("UPDATE store_locations SET latitude = %s, longitude = %s WHERE id = %s", updates)
+            conn.commit()
+            print(f"\n🎉 Backfilled coordinates for {len(updates)} of {len(stores)} store locations.")
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    import sys
+    backfill_store_coordinates(overwrite='--overwrite' in sys.argv)
@@ -0,0 +1,30 @@
+import re
+import math
+
+# Shared by app.py, init_db.py and backfill_store_coordinates.py, so the
+# database scripts don't have to import the whole Flask app.
+
+# Google Maps embed URLs carry the map centre as !2d<longitude>!3d<latitude>.
+MAP_EMBED_COORDS_RE = re.compile(r'!2d(-?\d+(?:\.\d+)?)!3d(-?\d+(?:\.\d+)?)')
+
+def valid_coordinates(latitude, longitude):
+    """True for finite coordinates within the latitude/longitude ranges."""
+    return (math.isfinite(latitude) and math.isfinite(longitude)
+            and -90 <= latitude <= 90 and -180 <= longitude <= 180)
+
+def parse_coordinates(latitude, longitude):
+    """Converts raw latitude/longitude values to floats. Returns (None, None) if they aren't valid."""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None, None
+    if not valid_coordinates(latitude, longitude):
+        return None, None
+    return latitude, longitude
+
+def parse_map_embed_coordinates(map_embed_url):
+    """Returns (latitude, longitude) from a Google Maps embed URL, or (None, None)."""
+    match = MAP_EMBED_COORDS_RE.search(map_embed_url or '')
+    if not match:
+        return None, None
+    return parse_coordinates(match.group(2), match.group(1))
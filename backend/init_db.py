@@ -7,6 +7,7 @@ import uuid
 import logging
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash
+from geo import parse_map_embed_coordinates
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -41,6 +42,62 @@ def alter_table_add_column(cursor, table_name, column_name, column_type):
     except psycopg2.Error as e:
         print(f"   - Could not alter '{table_name}' table for column '{column_name}': {e}")
 
+def create_store_location_index(cursor):
+    """Enables earthdistance and indexes store coordinates for nearest-store lookups."""
+    try:
+        cursor.execute("SAVEPOINT store_location_index;")
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS cube;")
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS earthdistance;")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS store_locations_earth_idx
+            ON store_locations USING gist (ll_to_earth(latitude, longitude));
+        """)
+        cursor.execute("RELEASE SAVEPOINT store_location_index;")
+        print("   - Spatial index on 'store_locations' created or already exists.")
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT store_location_index;")
+        print(f"   - Could not create spatial index on 'store_locations': {e}")
+
+def migrate_hero_slides(cursor):
+    """Moves slides from the legacy settings.hero_images column into hero_slides.
+
+    The column is only cleared once its slides have been copied; values that
+    can't be read as a list of slides are left in place for manual review.
+    """
+    cursor.execute("SELECT hero_images FROM settings WHERE id = 1 AND hero_images IS NOT NULL;")
+    row = cursor.fetchone()
+    if not row:
+        return
+    slides = row[0]
+    if isinstance(slides, str):
+        # Older versions of the app stored the slides as a JSON-encoded string.
+        try:
+            slides = json.loads(slides)
+        except ValueError:
+            slides = None
+    if not isinstance(slides, list) or not all(isinstance(slide, dict) for slide in slides):
+        print("   - Could not migrate 'settings.hero_images': it is not a list of slides. Left untouched.")
+        return
+
+    rows = [(slide.get('id') or f"slide{position + 1}", position, slide.get('headline'), slide.get('subheadline'),
+             slide.get('buttonText'), slide.get('imageUrl') or '')
+            for position, slide in enumerate(slides)]
+    cursor.executemany("""INSERT INTO hero_slides (id, position, headline, subheadline, button_text, image_url)
+                          VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO NOTHING;""", rows)
+    print(f"   - Migrated {len(rows)} hero slides from 'settings' to 'hero_slides'.")
+    # The slides now live in their own table; drop the duplicate copy from the settings row.
+    cursor.execute("UPDATE settings SET hero_images = NULL WHERE id = 1;")
+
+def rebuild_category_facets(cursor):
+    """Recomputes product_category_facets from scratch; the app keeps it current afterwards."""
+    cursor.execute("DELETE FROM product_category_facets;")
+    cursor.execute("""
+        INSERT INTO product_category_facets (category, product_count, in_stock_count, min_price, max_price)
+        SELECT category, COUNT(*), COUNT(*) FILTER (WHERE stock > 0), MIN(price), MAX(price)
+        FROM products GROUP BY category;
+    """)
+    print(f"   - Category facets rebuilt for {cursor.rowcount} categories.")
+
 def initialize_database():
     conn = get_db_connection()
     try:
@@ -87,6 +144,17 @@ def initialize_database():
                         facebook_url VARCHAR(2048)
                     )
                 """,
+                "hero_slides": """
+                    CREATE TABLE IF NOT EXISTS hero_slides (
+                        id VARCHAR(64) PRIMARY KEY,
+                        position INT NOT NULL DEFAULT 0,
+                        headline TEXT,
+                        subheadline TEXT,
+                        button_text VARCHAR(255),
+                        image_url TEXT NOT NULL DEFAULT '',
+                        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                    )
+                """,
                 "notifications": """
                     CREATE TABLE IF NOT EXISTS notifications (
                         id SERIAL PRIMARY KEY,
@@ -96,6 +164,32 @@ def initialize_database():
                         created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
                     )
                 """,
+                "image_blobs": """
+                    CREATE TABLE IF NOT EXISTS image_blobs (
+                        sha256 CHAR(64) PRIMARY KEY,
+                        mimetype VARCHAR(50) NOT NULL,
+                        size_bytes INT NOT NULL,
+                        data BYTEA NOT NULL,
+                        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                    )
+                """,
+                "product_category_facets": """
+                    CREATE TABLE IF NOT EXISTS product_category_facets (
+                        category VARCHAR(255) PRIMARY KEY,
+                        product_count INT NOT NULL DEFAULT 0,
+                        in_stock_count INT NOT NULL DEFAULT 0,
+                        min_price DECIMAL(10, 2),
+                        max_price DECIMAL(10, 2),
+                        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                    )
+                """,
+                "rate_limit_buckets": """
+                    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                        key VARCHAR(255) PRIMARY KEY,
+                        tokens DOUBLE PRECISION NOT NULL,
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                """,
                 "store_locations": """
                     CREATE TABLE IF NOT EXISTS store_locations (
                         id SERIAL PRIMARY KEY,
@@ -117,6 +211,17 @@ def initialize_database():
             # --- Table Alterations ---
             alter_table_add_column(cursor, 'notifications', 'title', 'TEXT')
             alter_table_add_column(cursor, 'settings', 'notifications_enabled', 'BOOLEAN DEFAULT TRUE')
+            alter_table_add_column(cursor, 'store_locations', 'latitude', 'DOUBLE PRECISION')
+            alter_table_add_column(cursor, 'store_locations', 'longitude', 'DOUBLE PRECISION')
+
+            # --- Extensions and Indexes ---
+            create_store_location_index(cursor)
+            cursor.execute("CREATE INDEX IF NOT EXISTS products_category_idx ON products (category);")
+            print("   - Index on 'products.category' created or already exists.")
+
+            # --- Data Migrations ---
+            migrate_hero_slides(cursor)
+            rebuild_category_facets(cursor)
             
             conn.commit()
             print("\n🎉 Database schema initialization complete!")
@@ -151,17 +256,19 @@ def seed_data():
                 insert_query = "INSERT INTO products (id, name, description, category, price, discount, stock, images, is_featured) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
                 cursor.executemany(insert_query, products_to_seed)
                 print(f"   - Seeded {len(products_to_seed)} products.")
+                rebuild_category_facets(cursor)
 
             # Seed Settings
             cursor.execute("SELECT COUNT(*) as count FROM settings WHERE id = 1")
             if cursor.fetchone()['count'] == 0:
-                hero_images = json.dumps([
-                    {"id": "slide1", "headline": "Elegancia Atemporal", "subheadline": "Descubre nuestra colección exclusiva.", "buttonText": "Explorar", "imageUrl": "https://site-2206080.mozfiles.com/files/WhatsApp%20Image%202024-07-16%20at%2011.45.24.jpeg"},
-                    {"id": "slide2", "headline": "Innovación en Cada Segundo", "subheadline": "Nuevos modelos con tecnología de punta.", "buttonText": "Ver Novedades", "imageUrl": "https://images.pexels.com/photos/190819/pexels-photo-190819.jpeg?auto=compress&cs=tinysrgb&w=1260&h=750&dpr=1"}
-                ])
-                sql = """INSERT INTO settings (id, hero_images, featured_collection_title, featured_collection_description, promo_section_title, promo_section_description, promo_section_video_url, phone, contact_email, twitter_url, instagram_url, facebook_url, notifications_enabled)
-                         VALUES (1, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-                values = (hero_images, "COLECCIÓN ROYAL SERIES", "Relojes para quienes valoran la distinción.", "ROYAL DELUXE", "Descubre la elegancia y la innovación.", "https://www.youtube.com/embed/dQw4w9WgXcQ", "+15551234567", "contacto@royalfernet.com", "#", "#", "#", True)
+                hero_slides = [
+                    ("slide1", 0, "Elegancia Atemporal", "Descubre nuestra colección exclusiva.", "Explorar", "https://site-2206080.mozfiles.com/files/WhatsApp%20Image%202024-07-16%20at%2011.45.24.jpeg"),
+                    ("slide2", 1, "Innovación en Cada Segundo", "Nuevos modelos con tecnología de punta.", "Ver Novedades", "https://images.pexels.com/photos/190819/pexels-photo-190819.jpeg?auto=compress&cs=tinysrgb&w=1260&h=750&dpr=1")
+                ]
+                cursor.executemany("INSERT INTO hero_slides (id, position, headline, subheadline, button_text, image_url) VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO NOTHING", hero_slides)
+                sql = """INSERT INTO settings (id, featured_collection_title, featured_collection_description, promo_section_title, promo_section_description, promo_section_video_url, phone, contact_email, twitter_url, instagram_url, facebook_url, notifications_enabled)
+                         VALUES (1, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+                values = ("COLECCIÓN ROYAL SERIES", "Relojes para quienes valoran la distinción.", "ROYAL DELUXE", "Descubre la elegancia y la innovación.", "https://www.youtube.com/embed/dQw4w9WgXcQ", "+15551234567", "contacto@royalfernet.com", "#", "#", "#", True)
                 cursor.execute(sql, values)
                 print("   - Default store settings inserted.")
             
@@ -172,8 +279,9 @@ def seed_data():
                     ('Boutique Principal - El Tesoro', 'Carrera 25A # 1A Sur-45', 'Medellín, Antioquia', '(604) 123 4567', 'L-S: 10am-9pm', 'https://www.google.com/maps/embed?pb=!1m18!1m12!1m3!1d3966.339668489869!2d-75.56821218898139!3d6.219085093754988!2m3!1f0!2f0!3f0!3m2!1i1024!2i768!4f13.1!3m3!1m2!1s0x8e44282dd3832d61%3A0x47b96e19a41c6e2a!2sParque%20Comercial%20El%20Tesoro!5e0!3m2!1sen!2sco!4v1721938978130!5m2!1sen!2sco', 'https://images.pexels.com/photos/279810/pexels-photo-279810.jpeg?auto=compress&cs=tinysrgb&w=1260&h=750&dpr=1'),
                     ('Tienda de Lujo - Andino', 'Carrera 11 # 82-71', 'Bogotá, Cundinamarca', '(601) 765 4321', 'L-S: 10am-8pm', 'https://www.google.com/maps/embed?pb=!1m18!1m12!1m3!1d3976.6215392769417!2d-74.05373888908864!3d4.661732942152869!2m3!1f0!2f0!3f0!3m2!1i1024!2i768!4f13.1!3m3!1m2!1s0x8e3f9a656a536e2b%3A0x671b407a51c9d5e!2sAndino%20Shopping%20Mall!5e0!3m2!1sen!2sco!4v1721939061036!5m2!1sen!2sco', 'https://images.pexels.com/photos/1484677/pexels-photo-1484677.jpeg?auto=compress&cs=tinysrgb&w=1260&h=750&dpr=1')
                 ]
-                insert_query = "INSERT INTO store_locations (name, address, city, phone, hours, map_embed_url, image_url) VALUES (%s, %s, %s, %s, %s, %s, %s)"
-                cursor.executemany(insert_query, locations_to_seed)
+                insert_query = """INSERT INTO store_locations (name, address, city, phone, hours, map_embed_url, image_url, latitude, longitude)
+                                  VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+                cursor.executemany(insert_query, [location + parse_map_embed_coordinates(location[5]) for location in locations_to_seed])
                 print(f"   - Seeded {len(locations_to_seed)} store locations.")
             
             conn.commit()
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+# Measures read latency while a burst of authentication requests hits the API,
+# with password hashing offloaded to the process pool and inline on request
+# threads. Each mode runs the app in a fresh threaded server process.
+#
+# With a database, the defaults storm /api/login as the seeded admin and read
+# /api/products. Without one, use --storm-path /api/register (it hashes before
+# touching the database) and --read-path /api/admission/stats.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_SCRIPT = """
+import sys
+from werkzeug.serving import run_simple
+from app import app
+run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)
+"""
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def request_status(url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def start_server(port, hash_workers):
+    env = dict(os.environ, PASSWORD_HASH_WORKERS=str(hash_workers),
+               # Lift the per-client auth limit so the storm reaches the hasher.
+               ADMISSION_POLICIES_JSON=json.dumps({'auth': {'concurrency': 1000, 'queue_timeout': 0, 'rate': 1e6, 'burst': 1e6}}))
+    server = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, str(port)], cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Server did not start")
+
+def read_latencies(url, readers, seconds):
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def reader():
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            request_status(url)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {'requests': len(latencies), 'p50_ms': statistics.median(latencies),
+            'p95_ms': latencies[int(len(latencies) * 0.95) - 1]}
+
+def run_mode(args, hash_workers):
+    port = free_port()
+    server = start_server(port, hash_workers)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        baseline = read_latencies(base_url + args.read_path, args.readers, args.seconds)
+
+        statuses = {}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def attacker(n):
+            i = 0
+            while not stop.is_set():
+                body = {'name': 'Storm', 'email': args.email.replace('@', f'+{n}-{i}@') if args.unique_emails else args.email,
+                        'password': args.password}
+                status = request_status(base_url + args.storm_path, body)
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+                i += 1
+
+        attackers = [threading.Thread(target=attacker, args=(n,)) for n in range(args.storm_clients)]
+        for thread in attackers:
+            thread.start()
+        time.sleep(0.5) # Let the storm build up before measuring.
+        during_storm = read_latencies(base_url + args.read_path, args.readers, args.seconds)
+        stop.set()
+        for thread in attackers:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {'baseline': summarize(baseline), 'storm': summarize(during_storm),
+            'storm_statuses': {str(status): count for status, count in sorted(statuses.items())}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports read latency during an authentication storm.")
+    parser.add_argument('--read-path', default='/api/products')
+    parser.add_argument('--storm-path', default='/api/login')
+    parser.add_argument('--email', default='admin@royalfernet.com')
+    parser.add_argument('--password', default='adminpass')
+    parser.add_argument('--unique-emails', action='store_true', help="Vary the email per request (for /api/register).")
+    parser.add_argument('--storm-clients', type=int, default=32)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pool-workers', type=int, default=2)
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    report = {'pool': run_mode(args, args.pool_workers), 'inline': run_mode(args, 0)}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"⏱️  {args.read_path} latency while {args.storm_clients} clients hit {args.storm_path}:")
+    for mode, result in report.items():
+        print(f"   {mode:<7} baseline p50 {result['baseline']['p50_ms']:7.1f} ms, p95 {result['baseline']['p95_ms']:7.1f} ms"
+              f" | storm p50 {result['storm']['p50_ms']:7.1f} ms, p95 {result['storm']['p95_ms']:7.1f} ms"
+              f" | storm responses {result['storm_statuses']}")
+
+if __name__ == '__main__':
+    main()
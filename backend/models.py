@@ -3,9 +3,10 @@ from datetime import datetime
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy_serializer import SerializerMixin
 
-# Determine the JSON type based on the database engine.
-# Use JSONB for PostgreSQL for better performance, and JSON for others (like MySQL/SQLite).
-json_type = JSONB if db.engine.name == 'postgresql' else db.JSON
+# Use JSONB on PostgreSQL for better performance, and JSON for others (like MySQL/SQLite).
+# The variant is resolved per dialect at query time, so importing this module
+# doesn't need to connect to the database to inspect the engine.
+json_type = db.JSON().with_variant(JSONB(), 'postgresql')
 
 class User(db.Model, SerializerMixin):
     __tablename__ = 'users'
@@ -68,3 +69,14 @@ class StoreLocation(db.Model, SerializerMixin):
     hours = db.Column(db.String(255), nullable=False)
     mapEmbedUrl = db.Column(db.Text, nullable=False)
     imageUrl = db.Column(db.String(2048), nullable=False)
+
+class HeroSlide(db.Model, SerializerMixin):
+    __tablename__ = 'hero_slides'
+
+    id = db.Column(db.String(64), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    headline = db.Column(db.Text)
+    subheadline = db.Column(db.Text)
+    buttonText = db.Column(db.String(255))
+    imageUrl = db.Column(db.Text, nullable=False, default='')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,103 @@
+import os
+import json
+import uuid
+import base64
+import argparse
+from werkzeug.test import EnvironBuilder
+
+# Compares a full PUT with a PATCH that only changes the price, for a product
+# with four large embedded images. Request sizes are always reported. Set
+# DATABASE_URL to also measure the WAL written by each update, which is the
+# write amplification Postgres pays for rewriting the row. Run it against an
+# otherwise idle database, since the WAL position is server-wide.
+
+def fake_image_data_uri(size_kb):
+    png = b'\x89PNG\r\n\x1a\n' + os.urandom(size_kb * 1024)
+    return f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}"
+
+def put_form(images, price):
+    form = {'name': 'Benchmark Watch', 'description': 'Write amplification benchmark.', 'category': 'Benchmark',
+            'price': str(price), 'discount': '0', 'stock': '10', 'isFeatured': 'on'}
+    for i, image in enumerate(images, start=1):
+        form[f'imageUrl{i}'] = image
+    return form
+
+def patch_form(price):
+    return {'price': str(price)}
+
+def request_size(method, form):
+    """Returns the size in bytes of the multipart body the admin UI would send."""
+    builder = EnvironBuilder(method=method, data=form, content_type='multipart/form-data')
+    try:
+        return len(builder.get_request().get_data())
+    finally:
+        builder.close()
+
+def wal_bytes_for(cursor, action):
+    cursor.execute("SELECT pg_current_wal_insert_lsn()")
+    before = cursor.fetchone()[0]
+    action()
+    cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s)", (before,))
+    return int(cursor.fetchone()[0])
+
+def measure_wal(images):
+    import psycopg2
+    from app import app, refresh_category_facets
+
+    client = app.test_client()
+    product_id = str(uuid.uuid4())
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""INSERT INTO products (id, name, description, category, price, discount, stock, images, is_featured)
+                              VALUES (%s, 'Benchmark Watch', 'Write amplification benchmark.', 'Benchmark', 100, 0, 10, %s, TRUE)""",
+                           (product_id, json.dumps(images)))
+
+            def put():
+                response = client.put(f'/api/products/{product_id}', data=put_form(images, 101),
+                                      content_type='multipart/form-data')
+                assert response.status_code == 200, response.get_data(as_text=True)
+
+            def patch():
+                response = client.patch(f'/api/products/{product_id}?fields=summary', data=patch_form(102),
+                                        content_type='multipart/form-data')
+                assert response.status_code == 200, response.get_data(as_text=True)
+
+            return {'put_wal_bytes': wal_bytes_for(cursor, put), 'patch_wal_bytes': wal_bytes_for(cursor, patch)}
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
+            refresh_category_facets(cursor, ['Benchmark'])
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports request size and WAL written by PUT vs PATCH product updates.")
+    parser.add_argument('--image-kb', type=int, default=1024, help="Size of each of the four images.")
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    images = [fake_image_data_uri(args.image_kb) for _ in range(4)]
+    report = {
+        'image_kb': args.image_kb,
+        'put_request_bytes': request_size('PUT', put_form(images, 101)),
+        'patch_request_bytes': request_size('PATCH', patch_form(102)),
+    }
+    if os.getenv('DATABASE_URL'):
+        report.update(measure_wal(images))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"📦 Product with four {args.image_kb} KB images, changing only the price:")
+    print(f"   PUT   request {report['put_request_bytes']:>12,} bytes")
+    print(f"   PATCH request {report['patch_request_bytes']:>12,} bytes")
+    if 'put_wal_bytes' in report:
+        print(f"   PUT   wrote   {report['put_wal_bytes']:>12,} bytes of WAL")
+        print(f"   PATCH wrote   {report['patch_wal_bytes']:>12,} bytes of WAL")
+    else:
+        print("   (set DATABASE_URL to also measure WAL written per update)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Imports the app and serves one request that doesn't touch the database.
+FIRST_REQUEST_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/api/admission/stats')
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(imported - start, done - start)
+"""
+
+def run_python(args, env=None):
+    return subprocess.run([sys.executable] + args, cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True, check=True)
+
+def import_costs():
+    """Returns {top-level module: cumulative import time in ms} for `import app`."""
+    result = run_python(['-X', 'importtime', '-c', 'import app'])
+    costs = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name[1:]
+        # Modules imported directly by app.py are indented by exactly two spaces.
+        if name.startswith('  ') and not name.startswith('   '):
+            costs[name.strip()] = int(cumulative) / 1000
+        elif name.strip() == 'app':
+            costs['app (total)'] = int(cumulative) / 1000
+    return costs
+
+def time_to_first_request(runs, warm_up):
+    env = dict(os.environ, DATABASE_URL=os.getenv('DATABASE_URL', 'postgresql://localhost/unused'))
+    if warm_up:
+        env['WARM_UP_ON_START'] = '1'
+    imports, totals = [], []
+    for _ in range(runs):
+        imported, total = run_python(['-c', FIRST_REQUEST_SCRIPT], env=env).stdout.split()
+        imports.append(float(imported) * 1000)
+        totals.append(float(total) * 1000)
+    return {'import_ms': statistics.median(imports), 'first_request_ms': statistics.median(totals)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports backend import cost and time-to-first-request.")
+    parser.add_argument('--runs', type=int, default=5, help="Cold starts to take the median over.")
+    parser.add_argument('--top', type=int, default=15, help="Number of modules to list.")
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    costs = import_costs()
+    report = {
+        'imports_ms': dict(sorted(costs.items(), key=lambda item: item[1], reverse=True)[:args.top]),
+        'cold': time_to_first_request(args.runs, warm_up=False),
+        'warmed': time_to_first_request(args.runs, warm_up=True),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print("📦 Import cost of modules loaded by app.py (cumulative):")
+    for name, ms in report['imports_ms'].items():
+        print(f"   {ms:8.1f} ms  {name}")
+    print(f"\n⏱️  Median over {args.runs} cold starts:")
+    for label in ('cold', 'warmed'):
+        timings = report[label]
+        print(f"   {label:<7} import {timings['import_ms']:7.1f} ms, first request {timings['first_request_ms']:7.1f} ms")
+
+if __name__ == '__main__':
+    main()
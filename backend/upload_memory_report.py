@@ -0,0 +1,146 @@
+import os
+import json
+import uuid
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from werkzeug.wrappers import Request
+
+# Measures Python heap usage while several large image uploads are parsed as
+# multipart requests and stored through store_uploaded_image, which streams them
+# with BlobCopySource. Bodies are read from disk, so only what the upload path
+# itself allocates is traced. Set DATABASE_URL to COPY into image_blobs for real
+# (the blobs are deleted afterwards); otherwise the COPY source is drained in the
+# same chunk sizes psycopg2 would read, and the database side isn't included.
+
+BOUNDARY = 'upload-memory-report'
+
+class DrainingCursor:
+    """Stands in for a psycopg2 cursor when no database is configured."""
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return None
+
+    def copy_expert(self, sql, source, size=8192):
+        while source.read(size):
+            pass
+
+def write_multipart_body(path, size_mb):
+    """Writes a multipart body with one random PNG-signed image of size_mb megabytes."""
+    with open(path, 'wb') as body:
+        body.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="imageFile"; filename="large.png"\r\n'
+                   f'Content-Type: image/png\r\n\r\n'.encode('utf-8'))
+        body.write(b'\x89PNG\r\n\x1a\n')
+        for _ in range(size_mb * 16):
+            body.write(os.urandom(64 * 1024))
+        body.write(f'\r\n--{BOUNDARY}--\r\n'.encode('utf-8'))
+
+def upload_request(path):
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+        'CONTENT_LENGTH': str(os.path.getsize(path)),
+        'wsgi.input': open(path, 'rb'),
+    }
+    return Request(environ)
+
+def run_uploads(paths, connect):
+    from app import app, store_uploaded_image
+
+    urls, errors = [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(paths))
+
+    def upload(path):
+        request = upload_request(path)
+        conn = connect()
+        try:
+            barrier.wait()
+            with app.test_request_context():
+                cursor = conn.cursor() if conn else DrainingCursor()
+                url = store_uploaded_image(cursor, request.files['imageFile'])
+                if conn:
+                    conn.commit()
+            with lock:
+                urls.append(url)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+        finally:
+            request.close()
+            request.environ['wsgi.input'].close()
+            if conn:
+                conn.close()
+
+    threads = [threading.Thread(target=upload, args=(path,)) for path in paths]
+    tracemalloc.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, urls, errors
+
+def delete_blobs(urls):
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM image_blobs WHERE sha256 = ANY(%s)",
+                           ([url.rsplit('/', 1)[1] for url in urls if url],))
+        conn.commit()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports peak Python memory for concurrent large image uploads.")
+    parser.add_argument('--uploads', type=int, default=8, help="Concurrent uploads.")
+    parser.add_argument('--size-mb', type=int, default=15, help="Size of each uploaded image.")
+    parser.add_argument('--json', action='store_true', help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    if os.getenv('DATABASE_URL'):
+        import psycopg2
+        connect = lambda: psycopg2.connect(os.environ['DATABASE_URL'])
+    else:
+        connect = lambda: None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f'{uuid.uuid4()}.multipart') for _ in range(args.uploads)]
+        for path in paths:
+            write_multipart_body(path, args.size_mb)
+        peak, urls, errors = run_uploads(paths, connect)
+
+    if os.getenv('DATABASE_URL'):
+        delete_blobs(urls)
+
+    upload_bytes = args.size_mb * 1024 * 1024
+    report = {
+        'uploads': args.uploads,
+        'upload_bytes': upload_bytes,
+        'database': bool(os.getenv('DATABASE_URL')),
+        'peak_bytes': peak,
+        'peak_bytes_per_upload': peak // args.uploads,
+        'stored': sum(1 for url in urls if url),
+        'errors': errors,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"📤 {args.uploads} concurrent uploads of {args.size_mb} MB each "
+          f"({'COPY into image_blobs' if report['database'] else 'no database, COPY source drained'}):")
+    print(f"   peak traced memory {peak / 1024 / 1024:8.2f} MB total, "
+          f"{report['peak_bytes_per_upload'] / 1024:8.1f} KB per upload")
+    print(f"   stored {report['stored']} of {args.uploads}")
+    for error in errors:
+        print(f"   error: {error}")
+
+if __name__ == '__main__':
+    main()
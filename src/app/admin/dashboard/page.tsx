@@ -56,6 +56,7 @@ import { Label } from "@/components/ui/label";
 import { Textarea } from "@/components/ui/textarea";
 import { Checkbox } from "@/components/ui/checkbox";
 import { addProduct, updateProduct, deleteProduct, addAdmin, sendNotificationAction, updateStoreSettings as updateStoreSettingsAction, deleteAdmin } from "@/lib/actions";
+import { buildProductPatch } from "@/lib/product-patch";
 import { Skeleton } from '@/components/ui/skeleton';
 import { useToast } from '@/hooks/use-toast';
 import {
@@ -179,7 +180,10 @@ const WhatsappIcon = (props: React.SVGProps<SVGSVGElement>) => (
 
 // Form component for adding and editing products
 function ProductForm({ product, onFormSubmit }: { product?: Product, onFormSubmit: () => void }) {
-    const action = product ? updateProduct.bind(null, product.id) : addProduct;
+    // Al editar solo se envían los campos que cambiaron (ver buildProductPatch).
+    const action = product
+        ? (formData: FormData) => updateProduct(product.id, buildProductPatch(product, formData))
+        : addProduct;
 
     return (
         <form action={action} onSubmit={onFormSubmit} className="grid gap-4 py-4" encType="multipart/form-data">
@@ -11,11 +11,20 @@
 
 import { revalidatePath } from 'next/cache';
 import { redirect } from 'next/navigation';
+import { headers } from 'next/headers';
+import { clientForwardingHeaders, clientIpFrom } from './client-forwarding';
 
 // Para las acciones del lado del servidor, usamos la variable de entorno para la URL de la API.
 // Esta se establecerá a la URL de Render.com en producción.
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL || 'http://127.0.0.1:5000';
 
+// Cabeceras para que el backend aplique sus límites de peticiones a la IP real del usuario.
+async function backendHeaders(extra: Record<string, string> = {}): Promise<Record<string, string>> {
+  const requestHeaders = await headers();
+  const clientIp = clientIpFrom(requestHeaders);
+  return { ...extra, ...clientForwardingHeaders(clientIp) };
+}
+
 export async function loginUser(formData: FormData) {
   const email = formData.get('email');
   const password = formData.get('password');
@@ -28,7 +37,7 @@ export async function loginUser(formData: FormData) {
   try {
     res = await fetch(`${API_BASE_URL}/api/login`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: await backendHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify({ email, password }),
       cache: 'no-store'
     });
@@ -51,7 +60,7 @@ export async function registerUser(formData: FormData) {
   
   await fetch(`${API_BASE_URL}/api/register`, {
     method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
+    headers: await backendHeaders({ 'Content-Type': 'application/json' }),
     body: JSON.stringify({ name, email, password }),
   });
   
@@ -61,6 +70,7 @@ export async function registerUser(formData: FormData) {
 export async function addProduct(formData: FormData) {
   const res = await fetch(`${API_BASE_URL}/api/products`, {
     method: 'POST',
+    headers: await backendHeaders(),
     body: formData,
   });
   
@@ -76,9 +86,14 @@ export async function addProduct(formData: FormData) {
   redirect('/admin/dashboard');
 }
 
+// Recibe solo los campos modificados (ver buildProductPatch) y los envía como PATCH.
 export async function updateProduct(id: string, formData: FormData) {
-  const res = await fetch(`${API_BASE_URL}/api/products/${id}`, {
-    method: 'PUT',
+  if ([...formData.keys()].length === 0) {
+    redirect('/admin/dashboard');
+  }
+  const res = await fetch(`${API_BASE_URL}/api/products/${id}?fields=summary`, {
+    method: 'PATCH',
+    headers: await backendHeaders(),
     body: formData,
   });
   
@@ -98,6 +113,7 @@ export async function updateProduct(id: string, formData: FormData) {
 export async function deleteProduct(id: string) {
     const res = await fetch(`${API_BASE_URL}/api/products/${id}`, {
       method: 'DELETE',
+      headers: await backendHeaders(),
     });
     if (!res.ok) { 
         console.error("Falló al eliminar el producto", await res.text());
@@ -118,7 +134,7 @@ export async function addAdmin(formData: FormData) {
   
   const res = await fetch(`${API_BASE_URL}/api/admins`, {
     method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
+    headers: await backendHeaders({ 'Content-Type': 'application/json' }),
     body: JSON.stringify(adminData),
   });
 
@@ -134,6 +150,7 @@ export async function addAdmin(formData: FormData) {
 export async function deleteAdmin(id: number) {
     const res = await fetch(`${API_BASE_URL}/api/admins/${id}`, {
       method: 'DELETE',
+      headers: await backendHeaders(),
     });
     if (!res.ok) { 
         const errorData = await res.json();
@@ -148,6 +165,7 @@ export async function updateStoreSettings(formData: FormData): Promise<{success:
   try {
       const res = await fetch(`${API_BASE_URL}/api/settings`, {
         method: 'POST', 
+        headers: await backendHeaders(),
         body: formData,
       });
 
@@ -192,7 +210,7 @@ export async function sendNotificationAction(formData: FormData): Promise<{succe
   try {
     const res = await fetch(`${API_BASE_URL}/api/notifications`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: await backendHeaders({ 'Content-Type': 'application/json' }),
       body: JSON.stringify(notificationData),
     });
 
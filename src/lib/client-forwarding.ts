@@ -0,0 +1,41 @@
+/**
+ * @fileoverview Reenvío de la IP del cliente al backend.
+ * Las Server Actions y la reescritura de /api llegan al backend desde el servidor de Next.js,
+ * así que el backend vería la misma IP para todos los usuarios. Estas cabeceras le indican la IP
+ * real del usuario; el backend solo las acepta junto con el token compartido INTERNAL_API_TOKEN.
+ */
+
+// Número de proxies delante de Next.js que añaden su entrada a X-Forwarded-For (p. ej. los
+// front ends de Google en Firebase App Hosting). Con 0, X-Forwarded-For no se usa.
+const CLIENT_IP_PROXY_HOPS = Number(process.env.CLIENT_IP_PROXY_HOPS || 0);
+
+type HeaderSource = { get(name: string): string | null };
+
+/**
+ * Devuelve la IP del usuario solo si viene de una fuente de confianza, o null si no se conoce.
+ * Las primeras entradas de X-Forwarded-For las controla el cliente, así que se cuentan
+ * CLIENT_IP_PROXY_HOPS entradas desde la derecha (las que añadieron nuestros proxies).
+ */
+export function clientIpFrom(requestHeaders: HeaderSource): string | null {
+  if (process.env.VERCEL) {
+    // Vercel sobrescribe x-real-ip con la IP del cliente; no se puede falsificar.
+    return requestHeaders.get('x-real-ip')?.trim() || null;
+  }
+  if (CLIENT_IP_PROXY_HOPS > 0) {
+    const entries = (requestHeaders.get('x-forwarded-for') ?? '').split(',').map((entry) => entry.trim());
+    if (entries.length >= CLIENT_IP_PROXY_HOPS) {
+      return entries[entries.length - CLIENT_IP_PROXY_HOPS] || null;
+    }
+  }
+  return null;
+}
+
+export function clientForwardingHeaders(clientIp: string | null): Record<string, string> {
+  const token = process.env.INTERNAL_API_TOKEN;
+  if (!token) {
+    return {};
+  }
+  // Sin IP conocida se envía solo el token: el backend sabe que la petición viene de Next.js
+  // y no la cuenta en el límite de un único cliente compartido por todos.
+  return clientIp ? { 'X-Client-IP': clientIp, 'X-Internal-Token': token } : { 'X-Internal-Token': token };
+}
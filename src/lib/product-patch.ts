@@ -0,0 +1,62 @@
+/**
+ * @fileoverview Construye el PATCH de un producto a partir del formulario de edición.
+ * Solo incluye los campos que cambiaron. Las imágenes que no se tocan se envían como
+ * `{"keep": índice}`, así el backend las copia sin que el navegador ni la Server Action
+ * vuelvan a enviar sus data URIs.
+ */
+import type { Product } from './definitions';
+
+type ImageSlot = { keep: number } | { url: string } | { file: string };
+
+const TEXT_FIELDS = ['name', 'description', 'category'] as const;
+const NUMBER_FIELDS = ['price', 'discount', 'stock'] as const;
+const MAX_PRODUCT_IMAGES = 4;
+
+export function buildProductPatch(product: Product, formData: FormData): FormData {
+  const patch = new FormData();
+
+  for (const field of TEXT_FIELDS) {
+    const value = formData.get(field);
+    if (value !== null && value !== (product[field] ?? '')) {
+      patch.set(field, value);
+    }
+  }
+  for (const field of NUMBER_FIELDS) {
+    const value = formData.get(field);
+    if (value !== null && value !== '' && Number(value) !== Number(product[field] ?? 0)) {
+      patch.set(field, value);
+    }
+  }
+  const isFeatured = formData.get('isFeatured') === 'on';
+  if (isFeatured !== Boolean(product.is_featured)) {
+    patch.set('isFeatured', isFeatured ? 'on' : 'off');
+  }
+
+  const images = product.images ?? [];
+  const slots: ImageSlot[] = [];
+  for (let i = 1; i <= MAX_PRODUCT_IMAGES; i++) {
+    const file = formData.get(`image${i}`);
+    const url = formData.get(`imageUrl${i}`);
+    const original = images[i - 1];
+    if (file instanceof File && file.size > 0) {
+      slots.push({ file: `image${i}` });
+      patch.set(`image${i}`, file);
+    } else if (typeof url === 'string') {
+      // Un campo de URL vacío quita la imagen; uno sin cambios la conserva.
+      if (url && original !== undefined && url === original) {
+        slots.push({ keep: i - 1 });
+      } else if (url) {
+        slots.push({ url });
+      }
+    } else if (original !== undefined) {
+      // La pestaña de URL no está montada (p. ej. imágenes subidas): la imagen no se tocó.
+      slots.push({ keep: i - 1 });
+    }
+  }
+  const unchanged = slots.length === images.length && slots.every((slot, index) => 'keep' in slot && slot.keep === index);
+  if (!unchanged) {
+    patch.set('imageSlots', JSON.stringify(slots));
+  }
+
+  return patch;
+}
@@ -0,0 +1,24 @@
+/**
+ * @fileoverview Middleware de Next.js para las peticiones a /api.
+ * Las llamadas del navegador a /api se reescriben hacia el backend de Python. Aquí se añaden
+ * las cabeceras con la IP real del usuario (y se descartan las que intente enviar el propio
+ * navegador) para que los límites de peticiones del backend se apliquen por cliente.
+ */
+import { NextResponse, type NextRequest } from 'next/server';
+import { clientForwardingHeaders, clientIpFrom } from '@/lib/client-forwarding';
+
+export function middleware(request: NextRequest) {
+  const headers = new Headers(request.headers);
+  headers.delete('X-Client-IP');
+  headers.delete('X-Internal-Token');
+
+  const clientIp = clientIpFrom(request.headers);
+  for (const [name, value] of Object.entries(clientForwardingHeaders(clientIp))) {
+    headers.set(name, value);
+  }
+  return NextResponse.next({ request: { headers } });
+}
+
+export const config = {
+  matcher: '/api/:path*',
+};